@@ -0,0 +1,241 @@
+import os
+import time
+import asyncio
+import httpx
+import requests
+import assemblyai as aai
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from rate_limit import TokenBucket, assemblyai_limiter
+
+# Status polling backoff, used when no webhook is configured (seconds)
+POLL_INITIAL_INTERVAL = float(os.getenv('ASSEMBLYAI_POLL_INITIAL_INTERVAL', 1))
+POLL_MAX_INTERVAL = float(os.getenv('ASSEMBLYAI_POLL_MAX_INTERVAL', 30))
+# Consecutive failed status checks tolerated before a poll gives up
+POLL_MAX_FAILURES = int(os.getenv('ASSEMBLYAI_POLL_MAX_FAILURES', 5))
+# Responses worth retrying a status check on
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Per-request timeout for AssemblyAI calls (seconds)
+ASSEMBLYAI_TIMEOUT = float(os.getenv('ASSEMBLYAI_TIMEOUT', 60))
+
+# When set, AssemblyAI notifies this URL on completion instead of being polled
+ASSEMBLYAI_WEBHOOK_URL = os.getenv('ASSEMBLYAI_WEBHOOK_URL')
+ASSEMBLYAI_WEBHOOK_SECRET = os.getenv('ASSEMBLYAI_WEBHOOK_SECRET')
+WEBHOOK_AUTH_HEADER = 'X-Webhook-Secret'
+if ASSEMBLYAI_WEBHOOK_URL and not ASSEMBLYAI_WEBHOOK_SECRET:
+    # The webhook endpoint rejects unauthenticated calls, so parked jobs would be lost
+    raise EnvironmentError('ASSEMBLYAI_WEBHOOK_SECRET must be set when ASSEMBLYAI_WEBHOOK_URL is.')
+
+# Optional speech model override (e.g. "nano" for faster turnaround on short
+# jobs); unset uses AssemblyAI's default model
+ASSEMBLYAI_SPEECH_MODEL = os.getenv('ASSEMBLYAI_SPEECH_MODEL')
+
+# Local media is streamed to AssemblyAI in chunks of this size
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+
+
+def file_chunks(path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yields the file's contents chunk by chunk.
+    """
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+async def file_chunks_async(path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """
+    Yields the file's contents chunk by chunk, reading the next chunk in a
+    thread while the current one is being sent, so disk reads overlap with
+    the network instead of alternating with it.
+    """
+    f = await asyncio.to_thread(open, path, 'rb')
+    pending = None
+    try:
+        pending = asyncio.ensure_future(asyncio.to_thread(f.read, chunk_size))
+        while chunk := await pending:
+            pending = asyncio.ensure_future(asyncio.to_thread(f.read, chunk_size))
+            yield chunk
+    finally:
+        if pending is not None:
+            # Never close the file under an in-flight read
+            await asyncio.gather(pending, return_exceptions=True)
+        f.close()
+
+
+class Client:
+    """
+    The one AssemblyAI entry point for captioning and chaptering. Uploads go
+    over pooled keep-alive connections and every request draws from the same
+    rate limiter, so both pipelines share one connection pool and one budget.
+    """
+
+    def __init__(self, limiter: TokenBucket = assemblyai_limiter):
+        self.limiter = limiter
+        # No adapter retries: a streamed upload body can't be replayed
+        self._session = requests.Session()
+        # Status checks are idempotent GETs, so they go over a pool sized for
+        # the worker's threads that retries transient failures
+        self._poll_session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=50,
+            pool_maxsize=50,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=RETRY_STATUSES),
+        )
+        self._poll_session.mount('https://', adapter)
+        self._poll_session.mount('http://', adapter)
+        # Async counterpart for uploads and polls made from the worker's event loop
+        self._async_session = httpx.AsyncClient(timeout=httpx.Timeout(ASSEMBLYAI_TIMEOUT))
+        self._transcriber = None
+
+    @property
+    def transcriber(self) -> aai.Transcriber:
+        """
+        The SDK transcriber, created on first use (once the API key is set)
+        and reused for every submission after that.
+        """
+        if self._transcriber is None:
+            self._transcriber = aai.Transcriber()
+        return self._transcriber
+
+    def upload(self, path: str) -> str:
+        """
+        Streams a local file to AssemblyAI's upload endpoint with chunked
+        transfer encoding, so memory use stays at one chunk whatever the file
+        size. Returns the upload URL to transcribe from.
+        """
+        with self.limiter:
+            response = self._session.post(
+                f"{aai.settings.base_url}/v2/upload",
+                headers={'authorization': aai.settings.api_key},
+                data=file_chunks(path),
+                timeout=ASSEMBLYAI_TIMEOUT,
+            )
+        response.raise_for_status()
+        return response.json()['upload_url']
+
+    async def upload_async(self, path: str) -> str:
+        """
+        Async version of upload with read-ahead. Returns the upload URL.
+        """
+        async with self.limiter:
+            response = await self._async_session.post(
+                f"{aai.settings.base_url}/v2/upload",
+                headers={'authorization': aai.settings.api_key},
+                content=file_chunks_async(path),
+            )
+        response.raise_for_status()
+        return response.json()['upload_url']
+
+    def transcribe(
+        self,
+        source: str,
+        *,
+        auto_chapters: bool = False,
+        webhook_url: Optional[str] = None
+    ) -> aai.Transcript:
+        """
+        Submits media (local path or URL) without waiting for it to be
+        processed; local files are uploaded first. If webhook_url is given,
+        AssemblyAI POSTs {transcript_id, status} to it once the transcript is
+        ready, otherwise follow up with wait_until_ready.
+        """
+        # Punctuated, cased text keeps caption blocks readable
+        config = aai.TranscriptionConfig(
+            punctuate=True,
+            format_text=True,
+            auto_chapters=auto_chapters,
+            speech_model=aai.SpeechModel(ASSEMBLYAI_SPEECH_MODEL) if ASSEMBLYAI_SPEECH_MODEL else None,
+        )
+        if os.path.isfile(source):
+            source = self.upload(source)
+        if webhook_url:
+            config.set_webhook(webhook_url, WEBHOOK_AUTH_HEADER, ASSEMBLYAI_WEBHOOK_SECRET)
+        with self.limiter:
+            return self.transcriber.submit(source, config)
+
+    def wait_until_ready(self, transcript_id: str) -> aai.Transcript:
+        """
+        Polls AssemblyAI until the transcript is processed, backing off
+        exponentially (1s, 2s, 4s, ... capped at POLL_MAX_INTERVAL).
+        Raises RuntimeError if transcription failed.
+        """
+        # Status checks are plain GETs: the SDK's get_by_id blocks on its own
+        # fixed-interval polling loop, so it is only called once the
+        # transcript is done
+        interval = POLL_INITIAL_INTERVAL
+        while True:
+            with self.limiter:
+                response = self._poll_session.get(
+                    f"{aai.settings.base_url}/v2/transcript/{transcript_id}",
+                    headers={'authorization': aai.settings.api_key},
+                    timeout=ASSEMBLYAI_TIMEOUT,
+                )
+            response.raise_for_status()
+            status = response.json()
+            if status['status'] == aai.TranscriptStatus.completed.value:
+                with self.limiter:
+                    return aai.Transcript.get_by_id(transcript_id)
+            if status['status'] == aai.TranscriptStatus.error.value:
+                raise RuntimeError(f"Transcription {transcript_id} failed: {status.get('error')}")
+            time.sleep(interval)
+            interval = min(interval * 2, POLL_MAX_INTERVAL)
+
+    async def wait_until_ready_async(self, transcript_id: str) -> aai.Transcript:
+        """
+        Async version of wait_until_ready that sleeps on the event loop, so a
+        waiting job holds no thread. Transient failures (timeouts, dropped
+        connections, 429/5xx) are retried with the same backoff, up to
+        POLL_MAX_FAILURES in a row.
+        """
+        interval = POLL_INITIAL_INTERVAL
+        failures = 0
+        while True:
+            try:
+                async with self.limiter:
+                    response = await self._async_session.get(
+                        f"{aai.settings.base_url}/v2/transcript/{transcript_id}",
+                        headers={'authorization': aai.settings.api_key},
+                    )
+                response.raise_for_status()
+                status = response.json()
+                failures = 0
+            except (httpx.TransportError, httpx.HTTPStatusError) as err:
+                if isinstance(err, httpx.HTTPStatusError) and err.response.status_code not in RETRY_STATUSES:
+                    raise
+                failures += 1
+                if failures >= POLL_MAX_FAILURES:
+                    raise
+                status = {'status': None}
+            if status['status'] == aai.TranscriptStatus.completed.value:
+                async with self.limiter:
+                    return await asyncio.to_thread(aai.Transcript.get_by_id, transcript_id)
+            if status['status'] == aai.TranscriptStatus.error.value:
+                raise RuntimeError(f"Transcription {transcript_id} failed: {status.get('error')}")
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, POLL_MAX_INTERVAL)
+
+
+def transcript_words(transcript: aai.Transcript) -> List[Dict]:
+    """
+    Returns the transcript's words as {'start', 'end', 'text'} dicts (ms).
+    The SDK's Word objects don't support subscripting.
+    """
+    return [{'start': w.start, 'end': w.end, 'text': w.text} for w in transcript.words or []]
+
+
+def transcript_chapters(transcript: aai.Transcript) -> List[Dict]:
+    """
+    Returns AssemblyAI's auto chapters as {'start', 'end', 'headline'} dicts,
+    with times converted from AssemblyAI's milliseconds to seconds to match
+    the LLM chapters they are reconciled with.
+    """
+    return [
+        {'start': chap.start / 1000, 'end': chap.end / 1000, 'headline': chap.headline}
+        for chap in transcript.chapters or []
+    ]
+
+
+client = Client()
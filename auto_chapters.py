@@ -1,9 +1,26 @@
 import os
+import re
 import json
+import asyncio
+import hashlib
 import argparse
+import orjson
+from array import array
+from pathlib import Path
+from bisect import bisect_left, bisect_right
 import assemblyai as aai
 import openai
-from typing import List, Dict
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError, ResponseError
+from redis.commands.search.field import VectorField
+from redis.commands.search.index_definition import IndexDefinition, IndexType
+from redis.commands.search.query import Query
+from typing import Awaitable, Callable, List, Dict, Optional, Tuple
+
+from assemblyai_client import client as assemblyai, transcript_words, transcript_chapters
+from captioning import caption_block_bounds
+from openai_client import client as openai_client, list_response_format, openai_slots
+from rate_limit import openai_limiter
 
 # Configuration
 ASSEMBLYAI_API_KEY = os.getenv('ASSEMBLYAI_API_KEY')
@@ -11,12 +28,62 @@ if not ASSEMBLYAI_API_KEY:
     raise EnvironmentError('Please set the ASSEMBLYAI_API_KEY environment variable.')
 aai.settings.api_key = ASSEMBLYAI_API_KEY
 
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY') or None
-if OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
+# Semantic cache for LLM chapters (enabled when REDIS_URL is set)
+REDIS_URL = os.getenv('REDIS_URL')
+CHAPTER_CACHE_TTL = int(os.getenv('CHAPTER_CACHE_TTL', 86400))
+CHAPTER_CACHE_SIMILARITY = float(os.getenv('CHAPTER_CACHE_SIMILARITY', 0.95))
+EMBEDDING_MODEL = 'text-embedding-3-small'
+EMBEDDING_DIM = 1536
+EMBEDDING_INPUT_CHARS = 20000  # keeps the embedding input well under the model's token limit
+
+# Static chaptering instructions. They lead every request byte-for-byte, with
+# only the transcript after them, so the provider's prompt prefix cache applies
+CHAPTER_SYSTEM_MESSAGE = {
+    'role': 'system',
+    'content': (
+        "You are an assistant that creates chapter markers for educational videos."
+        " Given the transcript text, suggest chapters in order with start and end times in seconds and a "
+        "short descriptive title."
+    )
+}
+
+CHAPTERS_RESPONSE_FORMAT = list_response_format('chapters', {
+    'type': 'object',
+    'properties': {
+        'start': {'type': 'number'},
+        'end': {'type': 'number'},
+        'title': {'type': 'string'}
+    },
+    'required': ['start', 'end', 'title'],
+    'additionalProperties': False
+})
 
-# Initialize Transcriber
-transcriber = aai.Transcriber()
+# Transcripts longer than one window are chaptered map-reduce style: a cheap
+# model proposes chapters per overlapping time window (in parallel), then the
+# main model only consolidates the short candidate list
+CHAPTER_MODEL = 'gpt-4o'
+WINDOW_CHAPTER_MODEL = 'gpt-4o-mini'
+CHAPTER_WINDOW_MS = 5 * 60 * 1000
+CHAPTER_WINDOW_OVERLAP_MS = 30 * 1000
+
+WINDOW_SYSTEM_MESSAGE = {
+    'role': 'system',
+    'content': (
+        "You are an assistant that finds topic changes in an excerpt of an educational video transcript."
+        " Each line starts with its start time in seconds in square brackets. Suggest chapters covering "
+        "the excerpt in order with start and end times in seconds and a short descriptive title."
+    )
+}
+
+CONSOLIDATE_SYSTEM_MESSAGE = {
+    'role': 'system',
+    'content': (
+        "You are an assistant that creates chapter markers for educational videos."
+        " You are given a JSON array of candidate chapters proposed for consecutive, overlapping excerpts "
+        "of one transcript. Merge duplicates, fold minor topics into their neighbours and return the final "
+        "chapters in order, each with a short descriptive title, keeping times in seconds."
+    )
+}
 
 
 def get_assembly_transcript(source: str):
@@ -24,42 +91,234 @@ def get_assembly_transcript(source: str):
     Submits media to AssemblyAI with auto_chapters enabled and returns
     the transcript object plus its chapter list.
     """
-    config = aai.TranscriptionConfig(auto_chapters=True)
-    transcript = transcriber.transcribe(source, config)
-    chapters = []
-    for chap in transcript.chapters or []:
-        chapters.append({
-            'start': chap.start,  # seconds
-            'end': chap.end,      # seconds
-            'headline': chap.headline
-        })
+    submitted = assemblyai.transcribe(source, auto_chapters=True)
+    transcript = assemblyai.wait_until_ready(submitted.id)
+    chapters = transcript_chapters(transcript)
     return transcript, chapters
 
 
-def generate_llm_chapters(transcript_text: str) -> List[Dict]:
+def normalize_transcript(text: str) -> str:
+    """
+    Lowercases and collapses whitespace so trivially different copies of a
+    transcript hash to the same cache key.
+    """
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+class ChapterCache:
+    """
+    Redis cache of LLM chapter responses. Exact repeats of a transcript are
+    found by a hash of its normalized text; near-duplicates (re-uploads,
+    light edits) by a KNN search over transcript embeddings in a RediSearch
+    HNSW index. Cache failures never fail a job; they fall through to the LLM.
+    """
+
+    KEY_PREFIX = 'llm:chap:'
+    INDEX_NAME = 'llm-chap-idx'
+
+    def __init__(self, redis_url: str, similarity: float = CHAPTER_CACHE_SIMILARITY,
+                 ttl: int = CHAPTER_CACHE_TTL):
+        self.redis = aioredis.from_url(redis_url)
+        self.similarity = similarity
+        self.ttl = ttl
+        self._index_ready = False
+
+    async def get_or_create(
+        self, transcript_text: str, create: Callable[[], Awaitable[List[Dict]]],
+        semantic: bool = True
+    ) -> List[Dict]:
+        """
+        Returns cached chapters for the transcript, or awaits create() and
+        caches its result. With semantic=False only exact repeats match and
+        no embedding is computed.
+        """
+        try:
+            key, embedding, chapters = await self._lookup(transcript_text, semantic)
+        except (RedisError, openai.OpenAIError) as err:
+            print(f'Chapter cache lookup failed: {err}. Calling the LLM directly.')
+            return await create()
+        if chapters is not None:
+            return chapters
+
+        chapters = await create()
+        try:
+            await self._store(key, embedding, chapters)
+        except RedisError as err:
+            print(f'Failed to cache LLM chapters: {err}')
+        return chapters
+
+    async def _lookup(
+        self, transcript_text: str, semantic: bool
+    ) -> Tuple[str, Optional[bytes], Optional[List[Dict]]]:
+        normalized = normalize_transcript(transcript_text)
+        key = self.KEY_PREFIX + hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+        cached = await self.redis.hget(key, 'chapters')
+        if cached:
+            return key, None, json.loads(cached)
+        if not semantic:
+            return key, None, None
+
+        embedding = await self._embed(normalized)
+        await self._ensure_index()
+        query = (
+            Query('*=>[KNN 1 @embedding $vec AS distance]')
+            .sort_by('distance')
+            .return_fields('chapters', 'distance')
+            .dialect(2)
+        )
+        result = await self.redis.ft(self.INDEX_NAME).search(query, query_params={'vec': embedding})
+        # Cosine distance is 1 - similarity
+        if result.docs and float(result.docs[0].distance) <= 1 - self.similarity:
+            return key, embedding, json.loads(result.docs[0].chapters)
+        return key, embedding, None
+
+    async def _store(self, key: str, embedding: Optional[bytes], chapters: List[Dict]) -> None:
+        mapping = {'chapters': json.dumps(chapters)}
+        if embedding is not None:
+            mapping['embedding'] = embedding
+        async with self.redis.pipeline() as pipe:
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def _embed(self, text: str) -> bytes:
+        async with openai_slots, openai_limiter:
+            response = await openai_client.embeddings.create(
+                model=EMBEDDING_MODEL, input=text[:EMBEDDING_INPUT_CHARS]
+            )
+        return array('f', response.data[0].embedding).tobytes()
+
+    async def _ensure_index(self) -> None:
+        if self._index_ready:
+            return
+        try:
+            await self.redis.ft(self.INDEX_NAME).create_index(
+                [VectorField('embedding', 'HNSW', {
+                    'TYPE': 'FLOAT32', 'DIM': EMBEDDING_DIM, 'DISTANCE_METRIC': 'COSINE'
+                })],
+                definition=IndexDefinition(prefix=[self.KEY_PREFIX], index_type=IndexType.HASH)
+            )
+        except ResponseError as err:
+            if 'already exists' not in str(err):
+                raise
+        self._index_ready = True
+
+
+chapter_cache = ChapterCache(REDIS_URL) if REDIS_URL else None
+
+
+async def generate_llm_chapters_async(transcript_text: str, words: Optional[List[Dict]] = None) -> List[Dict]:
     """
     Generates chapter markers via an LLM. Returns a list of dicts:
     [{'start': float, 'end': float, 'title': str}, ...]
+    Pass the transcript's word timings to let long transcripts be chaptered
+    window by window. Served from the chapter cache when an identical or
+    near-identical transcript was seen recently.
     """
-    if not OPENAI_API_KEY:
+    if not openai_client:
         raise EnvironmentError('OPENAI_API_KEY is required for LLM-generated chapters.')
 
-    prompt = (
-        "You are an assistant that creates chapter markers for educational videos."
-        " Given the transcript text, suggest chapters with start and end times in seconds and a "
-        "short descriptive title. Return strictly a JSON array of objects with keys 'start', 'end', 'title'.\n" +
-        transcript_text
-    )
-    response = openai.ChatCompletion.create(
-        model='gpt-4',
-        messages=[
-            {'role': 'system', 'content': 'Generate chapter markers from transcript.'},
-            {'role': 'user', 'content': prompt}
-        ],
-        temperature=0.3
+    if chapter_cache:
+        return await chapter_cache.get_or_create(
+            transcript_text, lambda: request_llm_chapters(transcript_text, words)
+        )
+    return await request_llm_chapters(transcript_text, words)
+
+
+async def request_llm_chapters(transcript_text: str, words: Optional[List[Dict]] = None) -> List[Dict]:
+    """
+    Asks the LLM for chapter markers, bypassing the transcript-level cache.
+    Transcripts longer than CHAPTER_WINDOW_MS are mapped over windows with
+    WINDOW_CHAPTER_MODEL and the candidates reduced with CHAPTER_MODEL.
+    """
+    if not words or words[-1]['end'] - words[0]['start'] <= CHAPTER_WINDOW_MS:
+        return await chat_chapters(CHAPTER_MODEL, CHAPTER_SYSTEM_MESSAGE, transcript_text)
+
+    windows = transcript_windows(words)
+    proposals = await asyncio.gather(*[propose_window_chapters(w) for w in windows])
+    candidates = merge_candidate_chapters([c for chapters in proposals for c in chapters])
+    return await chat_chapters(CHAPTER_MODEL, CONSOLIDATE_SYSTEM_MESSAGE, json.dumps(candidates))
+
+
+async def chat_chapters(model: str, system_message: Dict, content: str) -> List[Dict]:
+    """
+    Runs one chaptering chat completion constrained to CHAPTERS_RESPONSE_FORMAT
+    and returns the parsed chapter list.
+    """
+    async with openai_slots, openai_limiter:
+        response = await openai_client.chat.completions.create(
+            model=model,
+            messages=[
+                system_message,
+                {'role': 'user', 'content': content}
+            ],
+            temperature=0.3,
+            response_format=CHAPTERS_RESPONSE_FORMAT
+        )
+    message = response.choices[0].message
+    if message.refusal:
+        raise RuntimeError(f'LLM refused to generate chapters: {message.refusal}')
+    return orjson.loads(message.content)['chapters']
+
+
+def transcript_windows(words: List[Dict]) -> List[str]:
+    """
+    Splits a transcript into CHAPTER_WINDOW_MS windows that overlap by
+    CHAPTER_WINDOW_OVERLAP_MS. Each window is rendered as caption-sized
+    lines prefixed with their start time in seconds, so the model can place
+    chapter boundaries. Uses the same block logic as the SRT captions.
+    """
+    starts, ends, texts = [], [], []
+    for w in words:
+        starts.append(w['start'])
+        ends.append(w['end'])
+        texts.append(w['text'])
+
+    line_bounds = caption_block_bounds(starts, ends)
+    line_stops = line_bounds[1:] + [len(texts)]
+    lines = [f"[{starts[a] // 1000}] {' '.join(texts[a:b])}" for a, b in zip(line_bounds, line_stops)]
+    line_starts = [starts[a] for a in line_bounds]
+    line_ends = [ends[b - 1] for b in line_stops]
+
+    window_bounds = caption_block_bounds(
+        line_starts, line_ends, max_duration_ms=CHAPTER_WINDOW_MS, max_words=len(lines)
     )
-    content = response.choices[0].message.content.strip()
-    return json.loads(content)
+    windows = []
+    for first, stop in zip(window_bounds, window_bounds[1:] + [len(lines)]):
+        # Reach back so a topic straddling the window edge is seen whole at least once
+        first = bisect_left(line_starts, line_starts[first] - CHAPTER_WINDOW_OVERLAP_MS)
+        windows.append('\n'.join(lines[first:stop]))
+    return windows
+
+
+async def propose_window_chapters(window: str) -> List[Dict]:
+    """
+    Candidate chapters for one transcript window, cached by the window's text.
+    """
+    def create():
+        return chat_chapters(WINDOW_CHAPTER_MODEL, WINDOW_SYSTEM_MESSAGE, window)
+
+    if chapter_cache:
+        return await chapter_cache.get_or_create(window, create, semantic=False)
+    return await create()
+
+
+def merge_candidate_chapters(candidates: List[Dict]) -> List[Dict]:
+    """
+    Sorts window proposals by start and folds together those starting within
+    the window overlap of each other, i.e. the same chapter seen from two
+    neighbouring windows.
+    """
+    merged = []
+    for candidate in sorted(candidates, key=lambda c: c['start']):
+        if merged and candidate['start'] - merged[-1]['start'] < CHAPTER_WINDOW_OVERLAP_MS / 1000:
+            previous = merged[-1]
+            previous['end'] = max(previous['end'], candidate['end'])
+            if len(candidate['title']) > len(previous['title']):
+                previous['title'] = candidate['title']
+        else:
+            merged.append(dict(candidate))
+    return merged
 
 
 def reconcile_chapters(
@@ -69,68 +328,79 @@ def reconcile_chapters(
     Merges AssemblyAI and LLM chapter lists.
     Prefers AssemblyAI segments but overrides titles if LLM provides more detail,
     and adds non-overlapping LLM chapters.
+    Each LLM marker is matched against the AssemblyAI start times by binary
+    search, so this runs in O((N + M) log N) rather than O(N * M).
     """
-    reconciled = []
-
-    # Add assembly chapters, possibly overridden
-    for asm in assembly:
-        entry = asm.copy()
-        # Override title if more descriptive in LLM input
-        for marker in llm:
-            if asm['start'] <= marker['start'] < asm['end']:
-                if len(marker['title']) > len(asm.get('headline', '')):
-                    entry['headline'] = marker['title']
-        reconciled.append(entry)
-
-    # Append LLM-only chapters
-    for m in llm:
-        overlap = any(abs(m['start'] - a['start']) < 1 for a in assembly)
+    assembly = sorted(assembly, key=lambda a: a['start'])
+    asm_starts = [a['start'] for a in assembly]
+    reconciled = [a.copy() for a in assembly]
+
+    for marker in llm:
+        # Override title if more descriptive than the containing AssemblyAI chapter
+        i = bisect_right(asm_starts, marker['start']) - 1
+        if i >= 0 and marker['start'] < assembly[i]['end']:
+            if len(marker['title']) > len(assembly[i].get('headline', '')):
+                reconciled[i]['headline'] = marker['title']
+
+        # Append LLM-only chapters: no AssemblyAI chapter starts within 1s
+        j = bisect_left(asm_starts, marker['start'])
+        overlap = (
+            (j > 0 and marker['start'] - asm_starts[j - 1] < 1) or
+            (j < len(asm_starts) and asm_starts[j] - marker['start'] < 1)
+        )
         if not overlap:
             reconciled.append({
-                'start': m['start'],
-                'end': m['end'],
-                'headline': m['title']
+                'start': marker['start'],
+                'end': marker['end'],
+                'headline': marker['title']
             })
 
     # Sort by start time
     return sorted(reconciled, key=lambda x: x['start'])
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description='Auto-chapterning with AssemblyAI SDK and LLM reconciliation.'
-    )
-    parser.add_argument('-s', '--source', required=True,
-                        help='Path or URL to media file')
-    parser.add_argument('-o', '--output', required=True,
-                        help='Base path for output JSON files (without extension)')
-    args = parser.parse_args()
+def write_json(path: str, data) -> None:
+    """
+    Serializes with orjson straight to indented UTF-8 bytes and writes the
+    file in one call.
+    """
+    Path(path).write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+
 
+async def run(args):
     print('Requesting AssemblyAI transcript with auto-chapters...')
-    transcript, assembly_chapters = get_assembly_transcript(args.source)
+    transcript, assembly_chapters = await asyncio.to_thread(get_assembly_transcript, args.source)
     print(f'Retrieved {len(assembly_chapters)} AssemblyAI chapters.')
 
-    # Save AssemblyAI chapters
-    asm_path = f"{args.output}_assembly.json"
-    with open(asm_path, 'w', encoding='utf-8') as f:
-        json.dump(assembly_chapters, f, indent=2)
-    print(f'AssemblyAI chapters saved to {asm_path}')
-
     # LLM-generated chapters
     print('Generating LLM-based chapters...')
-    llm_chapters = generate_llm_chapters(transcript.text)
-    llm_path = f"{args.output}_llm.json"
-    with open(llm_path, 'w', encoding='utf-8') as f:
-        json.dump(llm_chapters, f, indent=2)
-    print(f'LLM chapters saved to {llm_path}')
+    llm_chapters = await generate_llm_chapters_async(transcript.text, transcript_words(transcript))
 
     # Reconciliation
     print('Reconciling chapter lists...')
     reconciled = reconcile_chapters(assembly_chapters, llm_chapters)
-    rec_path = f"{args.output}_reconciled.json"
-    with open(rec_path, 'w', encoding='utf-8') as f:
-        json.dump(reconciled, f, indent=2)
-    print(f'Reconciled chapters saved to {rec_path}')
+
+    # Save all three chapter lists, off the event loop and concurrently
+    outputs = {
+        'AssemblyAI': (f"{args.output}_assembly.json", assembly_chapters),
+        'LLM': (f"{args.output}_llm.json", llm_chapters),
+        'Reconciled': (f"{args.output}_reconciled.json", reconciled),
+    }
+    await asyncio.gather(*(asyncio.to_thread(write_json, path, data) for path, data in outputs.values()))
+    for label, (path, _) in outputs.items():
+        print(f'{label} chapters saved to {path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Auto-chapterning with AssemblyAI SDK and LLM reconciliation.'
+    )
+    parser.add_argument('-s', '--source', required=True,
+                        help='Path or URL to media file')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Base path for output JSON files (without extension)')
+    args = parser.parse_args()
+    asyncio.run(run(args))
 
 
 if __name__ == '__main__':
@@ -1,9 +1,35 @@
 import os
-import time
 import json
+import orjson
 import requests
 from datetime import datetime
+from functools import lru_cache
 from typing import Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Responses worth retrying a callback on
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+@lru_cache(maxsize=None)
+def get_session(max_retries: int, backoff_factor: float) -> requests.Session:
+    """
+    Returns a pooled session, kept alive across callbacks, whose adapter
+    retries failed requests with exponential backoff.
+    """
+    retry = Retry(
+        total=max(max_retries - 1, 0),  # max_retries counts attempts; Retry counts re-tries
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,  # callbacks are POSTs, which urllib3 skips by default
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=50, pool_maxsize=50, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 
 def send_callback(
@@ -29,8 +55,8 @@ def send_callback(
         }
     - status: 'completed' or 'failed'.
     - error_message: Optional error description if status is 'failed'.
-    - max_retries: Number of retry attempts on failure.
-    - backoff_factor: Multiplier for exponential backoff (in seconds).
+    - max_retries: Number of delivery attempts before giving up.
+    - backoff_factor: Multiplier for exponential backoff (in seconds), applied by urllib3.
 
     Returns:
     - True if notification was successful; False otherwise.
@@ -46,22 +72,16 @@ def send_callback(
         payload["error_message"] = error_message
 
     headers = {"Content-Type": "application/json"}
-    attempt = 0
-
-    while attempt < max_retries:
-        try:
-            response = requests.post(callback_url, headers=headers, json=payload, timeout=10)
-            response.raise_for_status()
-            print(f"Callback succeeded (status {response.status_code}).")
-            return True
-        except requests.RequestException as e:
-            wait = backoff_factor ** attempt
-            print(f"Callback attempt {attempt+1} failed: {e}. Retrying in {wait}s...")
-            time.sleep(wait)
-            attempt += 1
+    session = get_session(max_retries, backoff_factor)
 
-    print("All callback attempts failed.")
-    return False
+    try:
+        response = session.post(callback_url, headers=headers, data=orjson.dumps(payload), timeout=10)
+        response.raise_for_status()
+        print(f"Callback succeeded (status {response.status_code}).")
+        return True
+    except requests.RequestException as e:
+        print(f"All callback attempts failed: {e}")
+        return False
 
 
 if __name__ == '__main__':
@@ -1,7 +1,8 @@
 import os
 import argparse
-import assemblyai as aai
-from datetime import timedelta
+from typing import Dict, List
+
+from srt_format import build_srt, SRT_WRITE_BUFFER
 
 # Caption settings (tune as needed)
 MAX_CAPTION_DURATION_MS = 5000  # max block duration in ms
@@ -11,62 +12,64 @@ MAX_WORDS_PER_CAPTION = 15      # max words per block
 def ms_to_srt_timestamp(ms: int) -> str:
     """
     Convert milliseconds to SRT timestamp format: HH:MM:SS,mmm
+    Integer arithmetic only, so there is no float rounding (e.g. 1001 ms
+    used to come out as 00:00:01,000).
     """
-    total_seconds = ms / 1000.0
-    hours = int(total_seconds // 3600)
-    minutes = int((total_seconds % 3600) // 60)
-    seconds = int(total_seconds % 60)
-    milliseconds = int((total_seconds - int(total_seconds)) * 1000)
-    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+    ms = int(ms)
+    return '%02d:%02d:%02d,%03d' % (ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000)
 
 
-def transcript_to_srt(words: list, output_path: str):
+def caption_block_bounds(
+    starts: List[int],
+    ends: List[int],
+    max_duration_ms: int = MAX_CAPTION_DURATION_MS,
+    max_words: int = MAX_WORDS_PER_CAPTION
+) -> List[int]:
+    """
+    Single pass over word timings (ms) that returns the index of the first
+    word of each caption block. A new block starts when adding a word would
+    stretch the block past max_duration_ms or it already holds max_words.
+    """
+    bounds = []
+    block_start = 0
+    first = 0
+    for i, end_ms in enumerate(ends):
+        if not bounds or end_ms - block_start > max_duration_ms or i - first >= max_words:
+            bounds.append(i)
+            first = i
+            block_start = starts[i]
+    return bounds
+
+
+def transcript_to_srt(words: list, output_path: str) -> List[Dict]:
     """
     Convert list of word-level dicts into a .srt file.
     Each word: {'start': int_ms, 'end': int_ms, 'text': str}
+    Returns the SRT entries in the same shape as translation.parse_srt, so
+    callers can use them without reading the file back.
     """
-    srt_entries = []
-    current_block = []
-    block_start = None
-
-    def flush_block():
-        nonlocal current_block, block_start
-        if not current_block:
-            return
-        block_end = current_block[-1]['end']
-        text = ' '.join([w['text'] for w in current_block])
-        srt_entries.append((block_start, block_end, text))
-        current_block = []
-        block_start = None
-
+    # Struct-of-arrays word buffers, filled in one pass over words
+    starts, ends, texts = [], [], []
     for w in words:
-        start_ms = w['start']
-        end_ms = w['end']
-
-        if block_start is None:
-            block_start = start_ms
-            current_block.append({'start': start_ms, 'end': end_ms, 'text': w['text']})
-            continue
-
-        # Exceed duration or word count?
-        if ((end_ms - block_start) > MAX_CAPTION_DURATION_MS or
-            len(current_block) >= MAX_WORDS_PER_CAPTION):
-            flush_block()
-            block_start = start_ms
-
-        current_block.append({'start': start_ms, 'end': end_ms, 'text': w['text']})
-
-    # Flush any remaining
-    flush_block()
-
-    # Write SRT
-    with open(output_path, 'w', encoding='utf-8') as f:
-        for idx, (start, end, text) in enumerate(srt_entries, start=1):
-            start_ts = ms_to_srt_timestamp(start)
-            end_ts = ms_to_srt_timestamp(end)
-            f.write(f"{idx}\n")
-            f.write(f"{start_ts} --> {end_ts}\n")
-            f.write(f"{text}\n\n")
+        starts.append(w['start'])
+        ends.append(w['end'])
+        texts.append(w['text'])
+    bounds = caption_block_bounds(starts, ends)
+
+    entries = [
+        {
+            'index': idx,
+            'start': starts[first],
+            'end': ends[stop - 1],
+            'text': ' '.join(texts[first:stop]),
+        }
+        for idx, (first, stop) in enumerate(zip(bounds, bounds[1:] + [len(texts)]), start=1)
+    ]
+
+    # Write SRT, assembled in memory and emitted with a single write
+    with open(output_path, 'w', encoding='utf-8', buffering=SRT_WRITE_BUFFER) as f:
+        f.write(build_srt(entries))
+    return entries
 
 
 def main():
@@ -83,19 +86,24 @@ def main():
     )
     args = parser.parse_args()
 
+    # Imported here so the caption helpers above don't pull in the
+    # AssemblyAI client (HTTP sessions, Redis limiters, webhook settings)
+    import assemblyai as aai
+    from assemblyai_client import client, transcript_words
+
     api_key = os.getenv('ASSEMBLYAI_API_KEY')
     if not api_key:
         raise EnvironmentError('Please set the ASSEMBLYAI_API_KEY environment variable.')
 
     # Configure SDK
     aai.settings.api_key = api_key
-    transcriber = aai.Transcriber()
 
     print('Submitting transcription request...')
-    transcript = transcriber.transcribe(args.file)
+    submitted = client.transcribe(args.file)
+    transcript = client.wait_until_ready(submitted.id)
 
-    # transcript.words is a list of dicts with 'start', 'end', 'text'
-    words = transcript.words
+    # list of dicts with 'start', 'end', 'text'
+    words = transcript_words(transcript)
     if not words:
         raise RuntimeError('No word-level timestamps found in transcript.')
 
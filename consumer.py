@@ -1,23 +1,40 @@
-import pika, json
-from config import RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_USER, RABBITMQ_PASSWORD, RABBITMQ_QUEUE
-from worker import process_job
+import orjson, asyncio, functools, os, threading
+from concurrent.futures import ThreadPoolExecutor
+from config import RABBITMQ_QUEUE
+from job_queue import get_rabbitmq_connection, setup_queue
+from worker import process_job_async
 
-def on_message(ch, method, properties, body):
-    job = json.loads(body)
-    try:
-        process_job(job)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-    except Exception:
+# Jobs in flight per consumer. They spend nearly all their time waiting on
+# AssemblyAI/OpenAI/S3, so many of them share one event loop.
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 32))
+# Threads for the blocking SDK/S3 calls the jobs push off the loop
+WORKER_THREADS = int(os.getenv('WORKER_THREADS', 2 * WORKER_CONCURRENCY))
+
+# One loop for the consumer's lifetime, so async clients and their
+# connection pools are reused across jobs instead of rebuilt per message
+loop = asyncio.new_event_loop()
+loop.set_default_executor(ThreadPoolExecutor(max_workers=WORKER_THREADS))
+
+def settle(ch, delivery_tag, future):
+    # Runs on the loop thread; pika calls must be handed back to the connection's thread
+    if future.cancelled() or future.exception() is not None:
         # on fatal error, dead-letter
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        callback = functools.partial(ch.basic_nack, delivery_tag=delivery_tag, requeue=False)
+    else:
+        callback = functools.partial(ch.basic_ack, delivery_tag=delivery_tag)
+    ch.connection.add_callback_threadsafe(callback)
+
+def on_message(ch, method, properties, body):
+    job = orjson.loads(body)
+    future = asyncio.run_coroutine_threadsafe(process_job_async(job), loop)
+    future.add_done_callback(functools.partial(settle, ch, method.delivery_tag))
 
 if __name__ == "__main__":
-    creds = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-    params = pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=creds)
-    conn = pika.BlockingConnection(params)
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    conn = get_rabbitmq_connection()
     ch = conn.channel()
-    ch.queue_declare(queue=RABBITMQ_QUEUE, durable=True)
-    ch.basic_qos(prefetch_count=1)
+    setup_queue(ch)
+    ch.basic_qos(prefetch_count=WORKER_CONCURRENCY)
     ch.basic_consume(RABBITMQ_QUEUE, on_message)
     print(" [*] Waiting for jobs. To exit press CTRL+C")
-    ch.start_consuming()
\ No newline at end of file
+    ch.start_consuming()
@@ -1,12 +1,27 @@
-import json
 import time
+import orjson
+import threading
 import pika
 from datetime import datetime
+from typing import List
 from config import (
     RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_USER, RABBITMQ_PASSWORD,
     RABBITMQ_QUEUE, DEAD_LETTER_EXCHANGE, DEAD_LETTER_QUEUE
 )
 
+# Process-wide producer connection/channel, opened lazily and reused across
+# publishes. pika channels are not thread-safe, so access is serialized.
+_connection = None
+_channel = None
+_lock = threading.Lock()
+
+# Errors raised when the broker dropped an idle shared connection
+STALE_CONNECTION_ERRORS = (
+    pika.exceptions.StreamLostError,
+    pika.exceptions.ConnectionClosed,
+    pika.exceptions.ChannelClosed,
+)
+
 
 def get_rabbitmq_connection():
     """
@@ -38,32 +53,80 @@ def setup_queue(channel):
     channel.queue_declare(queue=RABBITMQ_QUEUE, durable=True, arguments=queue_arguments)
 
 
+def get_channel():
+    """
+    Returns the shared producer channel, (re)connecting if needed. Queues are
+    declared and the channel put in transaction mode once per connection
+    rather than on every publish. Callers must hold _lock.
+    """
+    global _connection, _channel
+    if _channel is None or _channel.is_closed or _connection.is_closed:
+        reset_connection()
+        _connection = get_rabbitmq_connection()
+        _channel = _connection.channel()
+        setup_queue(_channel)  # Ensure the queue is set up with proper arguments
+        # Publishes are only durable once tx_commit returns, and one commit
+        # acknowledges a whole batch in a single round-trip
+        _channel.tx_select()
+    return _channel
+
+
+def reset_connection():
+    """
+    Drops the shared connection so the next publish reconnects.
+    """
+    global _connection, _channel
+    if _connection is not None and _connection.is_open:
+        try:
+            _connection.close()
+        except pika.exceptions.AMQPError:
+            pass
+    _connection = None
+    _channel = None
+
+
 def enqueue_job(job_payload: dict, max_retries: int = 5):
     """
-    Attempts to enqueue the job payload into RabbitMQ.
+    Attempts to enqueue the job payload into RabbitMQ over the shared channel.
+    Raises an exception if all retries fail.
+    """
+    enqueue_jobs([job_payload], max_retries=max_retries)
+
+
+def enqueue_jobs(job_payloads: List[dict], max_retries: int = 5):
+    """
+    Publishes a batch of job payloads in one transaction over the shared
+    channel, so the whole batch costs a single broker round-trip.
     Implements a basic exponential backoff mechanism.
     Raises an exception if all retries fail.
     """
-    message = json.dumps(job_payload)
+    messages = [orjson.dumps(job_payload) for job_payload in job_payloads]
+    properties = pika.BasicProperties(
+        delivery_mode=2,  # Make message persistent
+    )
     attempt = 0
+    reconnected = False
     while attempt < max_retries:
         try:
-            connection = get_rabbitmq_connection()
-            channel = connection.channel()
-            setup_queue(channel)  # Ensure the queue is set up with proper arguments
-
-            # Publish the message to the specified queue.
-            channel.basic_publish(
-                exchange='',  # Direct publishing to the queue
-                routing_key=RABBITMQ_QUEUE,
-                body=message,
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # Make message persistent
-                )
-            )
-            connection.close()
-            return  # Successfully enqueued the message
+            with _lock:
+                channel = get_channel()
+                for message in messages:
+                    # Publish the message to the specified queue.
+                    channel.basic_publish(
+                        exchange='',  # Direct publishing to the queue
+                        routing_key=RABBITMQ_QUEUE,
+                        body=message,
+                        properties=properties
+                    )
+                channel.tx_commit()
+            return  # Successfully enqueued the batch
         except Exception as e:
+            with _lock:
+                reset_connection()
+            if not reconnected and isinstance(e, STALE_CONNECTION_ERRORS):
+                # Reconnect right away; only genuine publish failures back off
+                reconnected = True
+                continue
             attempt += 1
             wait_time = 2 ** attempt  # Exponential backoff
             print(f"Enqueue attempt {attempt} failed: {e}. Retrying in {wait_time}s...")
@@ -1,29 +1,51 @@
 import os
 import uuid
+import shutil
+import asyncio
+import orjson
+import boto3
+from contextlib import asynccontextmanager, suppress
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 from datetime import datetime
 from fastapi import (
     FastAPI, File, UploadFile, HTTPException, Header,
     BackgroundTasks, Depends, Body
 )
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, HttpUrl, validator
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field, HttpUrl, ValidationInfo, field_validator
+from typing import Any, Dict, List, Optional
 from config import (
     ACCESS_TOKEN,
     TEMP_UPLOAD_DIR,
     ALLOWED_LANGUAGES,
 )
-from job_queue import enqueue_job
+from job_queue import enqueue_jobs
+from callback_service import send_callback
+from assemblyai_client import ASSEMBLYAI_WEBHOOK_SECRET, WEBHOOK_AUTH_HEADER
 
-app = FastAPI(title="MAP Video Ingestion")
+# Uploads are streamed straight to S3 when a bucket is configured, in
+# parallel multipart chunks; otherwise they are copied to TEMP_UPLOAD_DIR
+S3_BUCKET = os.getenv('S3_BUCKET')
+s3_client = boto3.client('s3', config=BotoConfig(max_pool_connections=64)) if S3_BUCKET else None
+UPLOAD_TRANSFER_CONFIG = TransferConfig(multipart_chunksize=8 * 1024 * 1024, max_concurrency=8)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Uploads are copied to disk through one reusable buffer of this size
+UPLOAD_COPY_BUFFER = 1 << 20
+# Cap on uploads being stored at once, bounding buffer memory and threads
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', 16))
+_upload_slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+# Jobs submitted within this window (seconds) are published to RabbitMQ in
+# one batch, so bursts of submissions share broker round-trips
+ENQUEUE_BATCH_WINDOW = float(os.getenv('ENQUEUE_BATCH_WINDOW', 0.01))
+ENQUEUE_BATCH_MAX = int(os.getenv('ENQUEUE_BATCH_MAX', 100))
+# Requests answer 503 rather than wait longer than this (seconds) for the
+# broker, and a batch gets this many publish attempts
+ENQUEUE_TIMEOUT = float(os.getenv('ENQUEUE_TIMEOUT', 5))
+ENQUEUE_MAX_RETRIES = int(os.getenv('ENQUEUE_MAX_RETRIES', 1))
+_pending_jobs: asyncio.Queue = asyncio.Queue()
 
 
 # --- Dependencies & Auth --- #
@@ -36,23 +58,124 @@ def verify_access_token(authorization: Optional[str] = Header(None)):
         raise HTTPException(403, "Invalid or missing access token")
 
 
+# --- Helpers --- #
+
+def save_upload_file(upload_file: UploadFile, destination: str) -> None:
+    """
+    Copies an upload to disk in 1 MiB reads into a single reusable buffer,
+    rather than shutil's 64 KiB default with a new bytes object per chunk.
+    """
+    with open(destination, "wb") as out:
+        if not hasattr(upload_file.file, "readinto"):
+            # SpooledTemporaryFile only gained readinto in Python 3.11
+            shutil.copyfileobj(upload_file.file, out, UPLOAD_COPY_BUFFER)
+            return
+        buf = bytearray(UPLOAD_COPY_BUFFER)
+        mv = memoryview(buf)
+        while n := upload_file.file.readinto(buf):
+            out.write(mv[:n])
+
+
+async def publish_batch(batch: List[tuple]) -> None:
+    """
+    Publishes a batch of (job, future) pairs and settles their futures.
+    """
+    try:
+        await asyncio.to_thread(enqueue_jobs, [job for job, _ in batch], ENQUEUE_MAX_RETRIES)
+    except Exception as e:
+        print(f"Failed to enqueue {len(batch)} jobs: {e}")
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+    else:
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+
+async def enqueue_batches():
+    """
+    Drains submitted jobs forever, publishing whatever arrives within
+    ENQUEUE_BATCH_WINDOW of the first job as one batch.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _pending_jobs.get()]
+        deadline = loop.time() + ENQUEUE_BATCH_WINDOW
+        while len(batch) < ENQUEUE_BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_pending_jobs.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        await publish_batch(batch)
+
+
+async def submit_job(job: Dict[str, Any]) -> None:
+    """
+    Queues a job for the next batch and waits until RabbitMQ has it.
+    Raises HTTPException(503) if it could not be enqueued within
+    ENQUEUE_TIMEOUT.
+    """
+    future = asyncio.get_running_loop().create_future()
+    await _pending_jobs.put((job, future))
+    try:
+        await asyncio.wait_for(future, ENQUEUE_TIMEOUT)
+    except Exception:
+        raise HTTPException(503, "Job queue unavailable, please retry")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Runs the enqueue batcher for the app's lifetime. On shutdown it is
+    stopped and any jobs still waiting are published.
+    """
+    enqueue_task = asyncio.create_task(enqueue_batches())
+    yield
+    enqueue_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await enqueue_task
+    batch = []
+    while not _pending_jobs.empty():
+        batch.append(_pending_jobs.get_nowait())
+    if batch:
+        await publish_batch(batch)
+
+
+app = FastAPI(title="MAP Video Ingestion", default_response_class=ORJSONResponse, lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
 # --- Request Model --- #
 
 class VideoRequest(BaseModel):
-    video_url: Optional[HttpUrl] = None
+    video_url: Optional[HttpUrl] = Field(None, validate_default=True)
     preferred_languages: List[str]
     callback_url: HttpUrl
 
-    @validator("preferred_languages", each_item=True)
+    @field_validator("preferred_languages")
+    @classmethod
     def check_language(cls, v):
-        if v not in ALLOWED_LANGUAGES:
-            raise ValueError(f"Unsupported language: {v}")
+        for language in v:
+            if language not in ALLOWED_LANGUAGES:
+                raise ValueError(f"Unsupported language: {language}")
         return v
 
-    @validator("video_url", always=True)
-    def require_file_or_url(cls, v, values):
+    @field_validator("video_url")
+    @classmethod
+    def require_file_or_url(cls, v, info: ValidationInfo):
         # We require either a URL or a File upload; File handled separately
-        if not v and not values.get("_file_upload_included"):
+        if not v and not info.data.get("_file_upload_included"):
             raise ValueError("Either video_url or a file upload must be provided")
         return v
 
@@ -66,28 +189,33 @@ class VideoRequest(BaseModel):
     summary="Submit a video for captioning, translation, and auto-chapterning"
 )
 async def upload_video(
-    background_tasks: BackgroundTasks,
     payload: VideoRequest = Body(...),
     video: Optional[UploadFile] = File(None),
 ):
     """
     Submit either a direct file upload or a public video URL, specify target
-    languages, and a callback URL. Returns a job_id immediately.
+    languages, and a callback URL. Returns a job_id once the job is queued.
     """
-    # Ensure temp dir exists
-    os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
-
     job_id = str(uuid.uuid4())
     submission_ts = datetime.utcnow().isoformat() + "Z"
 
     # Handle file upload vs URL
     if video:
         ext = os.path.splitext(video.filename)[1]
-        saved_path = os.path.join(TEMP_UPLOAD_DIR, f"{job_id}{ext}")
         try:
-            with open(saved_path, "wb") as buf:
-                import shutil
-                shutil.copyfileobj(video.file, buf)
+            # Stored off the event loop so concurrent uploads interleave
+            async with _upload_slots:
+                if s3_client:
+                    s3_key = f"{job_id}/source/{job_id}{ext}"
+                    await asyncio.to_thread(
+                        s3_client.upload_fileobj, video.file, S3_BUCKET, s3_key,
+                        Config=UPLOAD_TRANSFER_CONFIG
+                    )
+                    saved_path = f"s3://{S3_BUCKET}/{s3_key}"
+                else:
+                    os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
+                    saved_path = os.path.join(TEMP_UPLOAD_DIR, f"{job_id}{ext}")
+                    await asyncio.to_thread(save_upload_file, video, saved_path)
         except Exception as e:
             raise HTTPException(500, f"Failed to save upload: {e}")
     else:
@@ -102,10 +230,61 @@ async def upload_video(
         "submission_time": submission_ts,
     }
 
-    # Enqueue in background
-    background_tasks.add_task(enqueue_job, job)
+    # Published with the next batch; returns once the broker has it
+    await submit_job(job)
 
     return {
         "job_id": job_id,
         "message": "Accepted: processing will begin shortly."
-    }
\ No newline at end of file
+    }
+
+
+@app.post(
+    "/api/assemblyai/webhook",
+    summary="AssemblyAI transcript completion notification"
+)
+async def assemblyai_webhook(
+    background_tasks: BackgroundTasks,
+    job: str,
+    notification: Dict[str, Any] = Body(...),
+    webhook_secret: Optional[str] = Header(None, alias=WEBHOOK_AUTH_HEADER),
+):
+    """
+    Called by AssemblyAI with {transcript_id, status} once a transcript parked
+    by a worker is done. Completed jobs are re-queued with the transcript id so
+    a worker can resume them; failed ones are reported to the client directly.
+    """
+    if not ASSEMBLYAI_WEBHOOK_SECRET or webhook_secret != ASSEMBLYAI_WEBHOOK_SECRET:
+        raise HTTPException(403, "Invalid webhook secret")
+
+    job_payload = orjson.loads(job)
+    transcript_id = notification.get("transcript_id")
+    if notification.get("status") == "completed":
+        job_payload["transcript_id"] = transcript_id
+        await submit_job(job_payload)
+    else:
+        background_tasks.add_task(
+            send_callback,
+            job_payload["job_id"],
+            job_payload["callback_url"],
+            {},
+            status="failed",
+            error_message=f"Transcription {transcript_id} failed",
+        )
+
+    return {"received": True}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    # libuv event loop and C HTTP parser; per-request access logging off
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("API_HOST", "0.0.0.0"),
+        port=int(os.getenv("API_PORT", 8000)),
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("API_WORKERS", os.cpu_count() or 1)),
+        limit_concurrency=int(os.getenv("API_LIMIT_CONCURRENCY", 256)),
+        access_log=False,
+    )
@@ -0,0 +1,42 @@
+import os
+import asyncio
+import openai
+from typing import Dict
+
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY') or None
+# The client retries 429s itself, honouring Retry-After with jittered backoff
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 5))
+
+# Cap on simultaneous OpenAI requests per process, shared by chaptering,
+# embeddings and translation
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', 8))
+openai_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+
+def list_response_format(name: str, item_schema: Dict) -> Dict:
+    """
+    Structured output format for replies of the form {name: [item, ...]}.
+    The API guarantees replies parse and match the schema; its root must be
+    an object, so the list is wrapped.
+    """
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': name,
+            'strict': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    name: {'type': 'array', 'items': item_schema}
+                },
+                'required': [name],
+                'additionalProperties': False
+            }
+        }
+    }
+
+
+client = (
+    openai.AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=OPENAI_MAX_RETRIES)
+    if OPENAI_API_KEY else None
+)
@@ -0,0 +1,127 @@
+import os
+import time
+import asyncio
+import threading
+import redis
+from redis.exceptions import RedisError
+
+# Shared limiter state lives in Redis when available, so every consumer
+# process draws from the same budget
+REDIS_URL = os.getenv('REDIS_URL')
+
+# AssemblyAI allows 20k requests per 5 minutes; OpenAI limits depend on the account tier
+ASSEMBLYAI_MAX_REQUESTS = int(os.getenv('ASSEMBLYAI_MAX_REQUESTS', 20000))
+ASSEMBLYAI_RATE_PERIOD = float(os.getenv('ASSEMBLYAI_RATE_PERIOD', 300))
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', 500))
+
+# Refill and take one token atomically; returns the seconds to wait (0 if taken)
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local fill_rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * fill_rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / fill_rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / fill_rate) + 1)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per `period` seconds, refilled continuously, with
+    bursts of up to `rate`. Thread-safe; use `with limiter:` in sync code and
+    `async with limiter:` in coroutines.
+    """
+
+    def __init__(self, rate: int, period: float):
+        self.capacity = rate
+        self.fill_rate = rate / period
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token if one is available and returns 0; otherwise returns
+        the number of seconds until one will be.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.fill_rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.fill_rate
+
+    async def reserve_async(self) -> float:
+        return self.reserve()
+
+    def acquire(self) -> None:
+        while (wait := self.reserve()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        while (wait := await self.reserve_async()) > 0:
+            await asyncio.sleep(wait)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class RedisTokenBucket(TokenBucket):
+    """
+    Token bucket whose state is kept in Redis, shared by all processes using
+    the same key. Falls back to limiting locally if Redis is unreachable.
+    """
+
+    def __init__(self, client: redis.Redis, key: str, rate: int, period: float):
+        super().__init__(rate, period)
+        self.key = key
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def reserve(self) -> float:
+        try:
+            return float(self._script(keys=[self.key], args=[self.capacity, self.fill_rate]))
+        except RedisError as err:
+            print(f'Shared rate limiter unavailable: {err}. Limiting locally.')
+            return super().reserve()
+
+    async def reserve_async(self) -> float:
+        # The Redis round-trip is blocking; keep it off the event loop
+        return await asyncio.to_thread(self.reserve)
+
+
+def make_limiter(name: str, rate: int, period: float) -> TokenBucket:
+    """
+    Returns a limiter shared across processes through Redis when REDIS_URL is
+    set, or a per-process one otherwise.
+    """
+    if REDIS_URL:
+        return RedisTokenBucket(redis.Redis.from_url(REDIS_URL), f'ratelimit:{name}', rate, period)
+    return TokenBucket(rate, period)
+
+
+assemblyai_limiter = make_limiter('assemblyai', ASSEMBLYAI_MAX_REQUESTS, ASSEMBLYAI_RATE_PERIOD)
+openai_limiter = make_limiter('openai', OPENAI_REQUESTS_PER_MINUTE, 60)
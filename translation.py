@@ -1,14 +1,22 @@
 import os
+import re
+import asyncio
+import hashlib
 import argparse
-import time
+import orjson
 import openai
-from typing import List, Dict
+from collections import OrderedDict
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+from typing import List, Dict, Iterable, Optional
+
+from openai_client import client as openai_client, list_response_format, openai_slots
+from rate_limit import openai_limiter
+from srt_format import build_srt, srt_timestamp_to_ms, SRT_WRITE_BUFFER
 
 # Configuration
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-if not OPENAI_API_KEY:
+if not openai_client:
     raise EnvironmentError('Please set the OPENAI_API_KEY environment variable.')
-openai.api_key = OPENAI_API_KEY
 
 # Supported target languages
 TARGET_LANGUAGE_MAP = {
@@ -22,80 +30,204 @@ TARGET_LANGUAGE_MAP = {
 MAX_RETRIES = int(os.getenv('TRANSLATION_MAX_RETRIES', 3))
 BACKOFF_FACTOR = int(os.getenv('TRANSLATION_BACKOFF', 2))
 
+# One SRT entry: index line, "start --> end" line, then text lines up to a
+# blank line (possibly none, for an empty caption)
+SRT_BLOCK = re.compile(r'^[ \t]*(\d+)[ \t]*\n([^\n]*?) --> ([^\n]*)\n((?:[^\n]+\n?)*)', re.M)
+
+# A small model is plenty for caption-length lines
+TRANSLATION_MODEL = 'gpt-4o-mini'
+
+# Fixed instructions, then the per-language prompt: every batch for one
+# language opens with the same cacheable prefix
+TRANSLATION_SYSTEM_MESSAGE = {
+    'role': 'system',
+    'content': (
+        "You are a translation assistant for video captions. You are given a JSON array of caption lines."
+        " Translate each line without changing its meaning or length, and return the translations in the "
+        "same order, one per input line."
+    )
+}
+TRANSLATION_PROMPTS = {
+    code: f"Translate each line into {language}:\n"
+    for code, language in TARGET_LANGUAGE_MAP.items()
+}
+
+TRANSLATIONS_RESPONSE_FORMAT = list_response_format('translations', {'type': 'string'})
+
+# Captions translated per request
+TRANSLATION_BATCH_SIZE = int(os.getenv('TRANSLATION_BATCH_SIZE', 50))
+
+# Translated lines are cached in-process, and in Redis when REDIS_URL is set
+REDIS_URL = os.getenv('REDIS_URL')
+TRANSLATION_CACHE_SIZE = int(os.getenv('TRANSLATION_CACHE_SIZE', 100_000))
+TRANSLATION_CACHE_TTL = int(os.getenv('TRANSLATION_CACHE_TTL', 86400))
+
 
 def parse_srt(srt_path: str) -> List[Dict]:
     """
     Parse an .srt file into a list of entries:
-    [{ 'index': int, 'start': str, 'end': str, 'text': str }, ...]
+    [{ 'index': int, 'start': int, 'end': int, 'text': str }, ...]
+    with start and end in milliseconds. Blocks that don't match the SRT
+    entry layout are skipped rather than raising.
     """
-    entries = []
-    with open(srt_path, 'r', encoding='utf-8') as f:
-        content = f.read().strip()
-    for block in content.split('\n\n'):
-        lines = block.split('\n')
-        if len(lines) < 3:
-            continue
-        idx = int(lines[0].strip())
-        start, end = lines[1].split(' --> ')
-        text = ' '.join(lines[2:]).strip()
-        entries.append({'index': idx, 'start': start, 'end': end, 'text': text})
-    return entries
+    # utf-8-sig strips the byte order mark many SRT files start with, which
+    # would otherwise hide the first entry's index
+    with open(srt_path, 'r', encoding='utf-8-sig') as f:
+        content = f.read()
+    # Entries without text are skipped
+    return [
+        {
+            'index': int(idx),
+            'start': srt_timestamp_to_ms(start),
+            'end': srt_timestamp_to_ms(end),
+            'text': text.replace('\n', ' ').strip()
+        }
+        for idx, start, end, text in SRT_BLOCK.findall(content)
+        if text.strip()
+    ]
 
 
 def write_srt(entries: List[Dict], out_path: str):
     """
-    Write entries list back to .srt file.
+    Write entries list back to .srt file, assembled in memory and emitted
+    with a single write.
+    """
+    with open(out_path, 'w', encoding='utf-8', buffering=SRT_WRITE_BUFFER) as f:
+        f.write(build_srt(entries))
+
+
+class TranslationCache:
+    """
+    Cache of translated caption lines keyed by (language, blake2b(text)), so
+    repeated lines ("[Music]", "Thank you.") are translated once. A bounded
+    in-process LRU sits in front of an optional shared Redis cache. Redis
+    failures never fail a job; the lines are simply translated again.
     """
-    with open(out_path, 'w', encoding='utf-8') as f:
-        for e in entries:
-            f.write(f"{e['index']}\n")
-            f.write(f"{e['start']} --> {e['end']}\n")
-            f.write(f"{e['text']}\n\n")
 
+    KEY_PREFIX = 'translate:'
 
-def translate_text(text: str, target_code: str) -> str:
+    def __init__(self, redis_url: Optional[str] = None, size: int = TRANSLATION_CACHE_SIZE,
+                 ttl: int = TRANSLATION_CACHE_TTL):
+        self.redis = aioredis.from_url(redis_url) if redis_url else None
+        self.size = size
+        self.ttl = ttl
+        self._local = OrderedDict()
+
+    def _key(self, target_code: str, text: str) -> str:
+        digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+        return f"{self.KEY_PREFIX}{target_code}:{digest}"
+
+    async def get_many(self, texts: Iterable[str], target_code: str) -> Dict[str, str]:
+        """
+        Returns {text: translation} for the texts that are cached.
+        """
+        found, missing = {}, {}
+        for text in texts:
+            key = self._key(target_code, text)
+            if key in self._local:
+                self._local.move_to_end(key)
+                found[text] = self._local[key]
+            else:
+                missing[key] = text
+        if self.redis and missing:
+            try:
+                values = await self.redis.mget(list(missing))
+            except RedisError as err:
+                print(f'Translation cache lookup failed: {err}')
+                return found
+            for (key, text), value in zip(missing.items(), values):
+                if value is not None:
+                    found[text] = value.decode('utf-8')
+                    self._remember(key, found[text])
+        return found
+
+    async def set_many(self, translations: Dict[str, str], target_code: str) -> None:
+        keys = {self._key(target_code, text): translation for text, translation in translations.items()}
+        for key, translation in keys.items():
+            self._remember(key, translation)
+        if self.redis and keys:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key, translation in keys.items():
+                        pipe.setex(key, self.ttl, translation)
+                    await pipe.execute()
+            except RedisError as err:
+                print(f'Failed to cache translations: {err}')
+
+    def _remember(self, key: str, translation: str) -> None:
+        self._local[key] = translation
+        self._local.move_to_end(key)
+        if len(self._local) > self.size:
+            self._local.popitem(last=False)
+
+
+translation_cache = TranslationCache(REDIS_URL)
+
+
+async def translate_batch(texts: List[str], target_code: str) -> List[str]:
     """
-    Translate a single caption text into the target language.
+    Translate a batch of caption texts into the target language in one
+    request, returning the translations in the same order.
     """
-    language = TARGET_LANGUAGE_MAP.get(target_code)
-    if not language:
+    instruction = TRANSLATION_PROMPTS.get(target_code)
+    if not instruction:
         raise ValueError(f"Unsupported language code: {target_code}")
 
-    prompt = (
-        f"Translate this text into {language} without changing meaning or length: '{text}'"
-    )
+    prompt = instruction + orjson.dumps(texts).decode()
     for attempt in range(MAX_RETRIES):
         try:
-            resp = openai.ChatCompletion.create(
-                model='gpt-4',
-                messages=[
-                    {'role': 'system', 'content': 'You are a translation assistant.'},
-                    {'role': 'user', 'content': prompt}
-                ],
-                temperature=0
-            )
-            return resp.choices[0].message.content.strip()
-        except openai.error.OpenAIError as err:
+            async with openai_slots, openai_limiter:
+                resp = await openai_client.chat.completions.create(
+                    model=TRANSLATION_MODEL,
+                    messages=[
+                        TRANSLATION_SYSTEM_MESSAGE,
+                        {'role': 'user', 'content': prompt}
+                    ],
+                    temperature=0,
+                    response_format=TRANSLATIONS_RESPONSE_FORMAT
+                )
+            message = resp.choices[0].message
+            if message.refusal:
+                raise ValueError(f"model refused: {message.refusal}")
+            translations = orjson.loads(message.content)['translations']
+            if len(translations) != len(texts):
+                raise ValueError(f"expected {len(texts)} translations, got {translations!r:.200}")
+            return [t.strip() for t in translations]
+        except (openai.OpenAIError, ValueError) as err:
             wait = BACKOFF_FACTOR ** attempt
             print(f"Translation error (attempt {attempt+1}): {err}. Retrying in {wait}s...")
-            time.sleep(wait)
+            await asyncio.sleep(wait)
     raise RuntimeError('Translation failed after multiple attempts.')
 
 
-def translate_srt(entries: List[Dict], target_code: str) -> List[Dict]:
+async def translate_texts(texts: List[str], target_code: str) -> List[str]:
+    """
+    Translate caption texts into the target language, in order. Each
+    distinct text is translated once, and cached ones not at all; the rest
+    are sent TRANSLATION_BATCH_SIZE at a time, batches concurrently.
+    """
+    unique = list(dict.fromkeys(texts))
+    found = await translation_cache.get_many(unique, target_code)
+    missing = [text for text in unique if text not in found]
+    chunks = [missing[i:i + TRANSLATION_BATCH_SIZE] for i in range(0, len(missing), TRANSLATION_BATCH_SIZE)]
+    results = await asyncio.gather(*(translate_batch(chunk, target_code) for chunk in chunks))
+    translated = {}
+    for chunk, translations in zip(chunks, results):
+        translated.update(zip(chunk, translations))
+    await translation_cache.set_many(translated, target_code)
+    found.update(translated)
+    return [found[text] for text in texts]
+
+
+async def translate_srt(entries: List[Dict], target_code: str) -> List[Dict]:
     """
     Translate all entries into target language, preserving timestamps.
     """
-    translated = []
-    for e in entries:
-        txt = translate_text(e['text'], target_code)
-        translated.append({
-            'index': e['index'],
-            'start': e['start'],
-            'end': e['end'],
-            'text': txt
-        })
-    return translated
+    texts = await translate_texts([e['text'] for e in entries], target_code)
+    return [
+        {'index': e['index'], 'start': e['start'], 'end': e['end'], 'text': txt}
+        for e, txt in zip(entries, texts)
+    ]
 
 
 def main():
@@ -111,13 +243,19 @@ def main():
     args = parser.parse_args()
 
     entries = parse_srt(args.source)
+    codes = []
     for code in args.targets.split(','):
         code = code.strip()
         if code not in TARGET_LANGUAGE_MAP:
             print(f"Skipping unsupported code: {code}")
             continue
-        print(f"Translating to {TARGET_LANGUAGE_MAP[code]}...")
-        translated = translate_srt(entries, code)
+        codes.append(code)
+    print(f"Translating to {', '.join(TARGET_LANGUAGE_MAP[c] for c in codes)}...")
+
+    async def translate_all():
+        return await asyncio.gather(*(translate_srt(entries, code) for code in codes))
+
+    for code, translated in zip(codes, asyncio.run(translate_all())):
         out_file = f"{args.output}_{code}.srt"
         write_srt(translated, out_file)
         print(f"Written {out_file}")
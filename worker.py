@@ -1,16 +1,26 @@
 import os
-import json
 import uuid
+import shutil
+import asyncio
 import logging
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import boto3
-from typing import Dict, Any
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+from typing import Any, Dict, List
+from urllib.parse import urlencode, urlsplit, urlunsplit
 import assemblyai as aai
 import openai
 
+from assemblyai_client import (
+    client as assemblyai, transcript_words, transcript_chapters, ASSEMBLYAI_WEBHOOK_URL
+)
 from captioning import ms_to_srt_timestamp, transcript_to_srt
-from translation import parse_srt, write_srt, translate_srt
-from auto_chapters import get_assembly_transcript, generate_llm_chapters, reconcile_chapters
+from translation import write_srt, translate_srt
+from auto_chapters import generate_llm_chapters_async, reconcile_chapters, write_json
 from callback_service import send_callback
 
 # Configure logging
@@ -20,6 +30,21 @@ logger = logging.getLogger(__name__)
 # AWS S3 settings (ensure these env vars are set)
 S3_BUCKET = os.getenv('S3_BUCKET')
 AWS_REGION = os.getenv('AWS_REGION')
+# Media downloads are copied to disk in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Keep-alive session for media downloads, so jobs fetching from the same
+# hosts reuse connections instead of handshaking every time
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504)),
+)
+SESSION.mount('http://', _adapter)
+SESSION.mount('https://', _adapter)
+# How long AssemblyAI may fetch media uploaded through the API from S3 (seconds)
+S3_MEDIA_URL_TTL = int(os.getenv('S3_MEDIA_URL_TTL', 12 * 3600))
 
 # AssemblyAI & OpenAI init
 ASSEMBLYAI_API_KEY = os.getenv('ASSEMBLYAI_API_KEY')
@@ -28,32 +53,121 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY') or None
 if OPENAI_API_KEY:
     openai.api_key = OPENAI_API_KEY
 
-# Initialize AWS S3 client
-s3_client = boto3.client('s3') if S3_BUCKET else None
+# Initialize AWS S3 client once per worker process; the pool is sized for
+# many concurrent jobs uploading at once (botocore's default is 10)
+s3_client = boto3.client('s3', config=BotoConfig(max_pool_connections=64))
+# Artifacts are mostly small; only split files over 8 MiB into threaded parts
+ARTIFACT_TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, use_threads=True)
 
 
 def upload_to_s3(local_path: str, s3_key: str) -> str:
     """
     Upload a local file to S3 and return its HTTPS URL.
     """
-    if not s3_client:
+    if not S3_BUCKET:
         raise RuntimeError('S3_BUCKET and AWS credentials must be configured')
-    s3_client.upload_file(local_path, S3_BUCKET, s3_key)
+    s3_client.upload_file(local_path, S3_BUCKET, s3_key, Config=ARTIFACT_TRANSFER_CONFIG)
     return f"https://{S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
 
 
+def write_srt_to_s3(entries: List[Dict], local_path: str, s3_key: str) -> str:
+    """
+    Writes SRT entries to a local file, uploads it to S3 and returns its URL.
+    """
+    write_srt(entries, local_path)
+    return upload_to_s3(local_path, s3_key)
+
+
+def presign_s3_uri(uri: str) -> str:
+    """
+    Returns a time-limited HTTPS URL for an s3://bucket/key URI.
+    """
+    if not S3_BUCKET:
+        raise RuntimeError('S3_BUCKET and AWS credentials must be configured')
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return s3_client.generate_presigned_url(
+        'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=S3_MEDIA_URL_TTL
+    )
+
+
 def download_media(source_url: str, dest_path: str) -> None:
     """
-    Downloads media from a URL to a local path.
+    Downloads media from a URL to a local path, streamed in 1 MiB writes.
     """
-    resp = requests.get(source_url, stream=True)
-    resp.raise_for_status()
-    with open(dest_path, 'wb') as f:
-        for chunk in resp.iter_content(chunk_size=8192):
-            f.write(chunk)
+    with SESSION.get(source_url, stream=True) as resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        with open(dest_path, 'wb') as f:
+            shutil.copyfileobj(resp.raw, f, length=DOWNLOAD_CHUNK_SIZE)
 
 
-def process_job(job_payload: Dict[str, Any]) -> None:
+def build_webhook_url(job_payload: Dict[str, Any]) -> str:
+    """
+    Returns the AssemblyAI webhook URL for a job. The job payload travels in
+    the query string so the webhook handler can re-enqueue it as-is; any
+    query ASSEMBLYAI_WEBHOOK_URL already carries is kept.
+    """
+    parts = urlsplit(ASSEMBLYAI_WEBHOOK_URL)
+    job_query = urlencode({'job': orjson.dumps(job_payload)})
+    query = f"{parts.query}&{job_query}" if parts.query else job_query
+    return urlunsplit(parts._replace(query=query))
+
+
+async def prepare_media(job_id: str, media_source: str) -> str:
+    """
+    Returns a URL AssemblyAI can transcribe the job's media from, downloading
+    and uploading it first if needed.
+    """
+    local_media = media_source
+    if media_source.startswith('s3://'):
+        # Streamed to S3 by the API; AssemblyAI fetches it from there directly
+        return presign_s3_uri(media_source)
+    if media_source.startswith('http'):
+        local_media = f"/tmp/{job_id}{os.path.splitext(media_source)[1]}"
+        logger.info(f"Downloading media to {local_media}...")
+        await asyncio.to_thread(download_media, media_source, local_media)
+
+    if os.path.isfile(local_media):
+        logger.info("Uploading media to AssemblyAI...")
+        return await assemblyai.upload_async(local_media)
+    return local_media
+
+
+async def chapter_stage(job_id: str, transcript: aai.Transcript, words: List[Dict]) -> str:
+    """
+    Reconciles AssemblyAI's chapters for the transcript with LLM chapters and
+    uploads the result. Returns its URL.
+    """
+    logger.info("Generating auto-chapters via LLM...")
+    llm_chaps = await generate_llm_chapters_async(transcript.text, words)
+    reconciled_chaps = reconcile_chapters(transcript_chapters(transcript), llm_chaps)
+    chap_local = f"/tmp/{job_id}_chapters.json"
+    await asyncio.to_thread(write_json, chap_local, reconciled_chaps)
+    chapters_s3_key = f"{job_id}/chapters/{job_id}_reconciled.json"
+    return await asyncio.to_thread(upload_to_s3, chap_local, chapters_s3_key)
+
+
+async def translation_stage(job_id: str, entries: List[Dict], languages: List[str]) -> Dict[str, str]:
+    """
+    Translates the caption entries into every requested language and
+    uploads them. Returns {language code: URL}.
+    """
+    logger.info("Translating captions...")
+    translated = await asyncio.gather(*(translate_srt(entries, code) for code in languages))
+    uploads = []
+    for code, txt_entries in zip(languages, translated):
+        tr_local = f"/tmp/{job_id}_{code}.srt"
+        tr_s3_key = f"{job_id}/translations/{job_id}_{code}.srt"
+        uploads.append(asyncio.to_thread(write_srt_to_s3, txt_entries, tr_local, tr_s3_key))
+    # The files are independent; write and send them all at once, off the loop
+    return dict(zip(languages, await asyncio.gather(*uploads)))
+
+
+async def process_job_async(job_payload: Dict[str, Any]) -> None:
+    """
+    Runs the full pipeline for one job. Blocking SDK, S3 and file calls are
+    pushed to threads so several jobs can share one event loop.
+    """
     job_id = job_payload['job_id']
     media_source = job_payload['file_path']
     callback_url = job_payload['callback_url']
@@ -61,44 +175,39 @@ def process_job(job_payload: Dict[str, Any]) -> None:
     submitted_at = job_payload.get('submission_time')
 
     try:
-        # 1. Download media if needed
-        local_media = media_source
-        if media_source.startswith('http'):
-            local_media = f"/tmp/{job_id}{os.path.splitext(media_source)[1]}"
-            logger.info(f"Downloading media to {local_media}...")
-            download_media(media_source, local_media)
-
-        # 2. Captioning
-        logger.info("Generating captions via AssemblyAI...")
-        transcriber = aai.Transcriber()
-        transcript = transcriber.transcribe(local_media)
-        words = transcript.words  # list of {'start','end','text'}
+        # 1./2. Captioning: one AssemblyAI transcription, with auto chapters,
+        # serves captions, chaptering and translation
+        transcript_id = job_payload.get('transcript_id')
+        if transcript_id:
+            # Resumed by the AssemblyAI webhook: the transcript is ready and
+            # the media isn't needed again
+            logger.info(f"Fetching completed transcript {transcript_id}...")
+            transcript = await assemblyai.wait_until_ready_async(transcript_id)
+        else:
+            media_url = await prepare_media(job_id, media_source)
+            if ASSEMBLYAI_WEBHOOK_URL:
+                # Hand the wait over to AssemblyAI and free this worker
+                submitted = await asyncio.to_thread(
+                    assemblyai.transcribe, media_url,
+                    auto_chapters=True, webhook_url=build_webhook_url(job_payload)
+                )
+                logger.info(f"Job {job_id} waiting on AssemblyAI transcript {submitted.id}.")
+                return
+            logger.info("Generating captions via AssemblyAI...")
+            submitted = await asyncio.to_thread(assemblyai.transcribe, media_url, auto_chapters=True)
+            transcript = await assemblyai.wait_until_ready_async(submitted.id)
+        words = transcript_words(transcript)  # list of {'start','end','text'}
         srt_local = f"/tmp/{job_id}.srt"
-        transcript_to_srt(words, srt_local)
+        entries = await asyncio.to_thread(transcript_to_srt, words, srt_local)
         captions_s3_key = f"{job_id}/captions/{job_id}.srt"
-        captions_url = upload_to_s3(srt_local, captions_s3_key)
-
-        # 3. Auto-chapterning
-        logger.info("Generating auto-chapters via AssemblyAI & LLM...")
-        _, assembly_chaps = get_assembly_transcript(local_media)
-        llm_chaps = generate_llm_chapters(transcript.text)
-        reconciled_chaps = reconcile_chapters(assembly_chaps, llm_chaps)
-        chap_local = f"/tmp/{job_id}_chapters.json"
-        with open(chap_local, 'w', encoding='utf-8') as f:
-            json.dump(reconciled_chaps, f)
-        chapters_s3_key = f"{job_id}/chapters/{job_id}_reconciled.json"
-        chapters_url = upload_to_s3(chap_local, chapters_s3_key)
-
-        # 4. Translation
-        logger.info("Translating captions...")
-        entries = parse_srt(srt_local)
-        translation_urls = {}
-        for code in languages:
-            txt_entries = translate_srt(entries, code)
-            tr_local = f"/tmp/{job_id}_{code}.srt"
-            write_srt(txt_entries, tr_local)
-            tr_s3_key = f"{job_id}/translations/{job_id}_{code}.srt"
-            translation_urls[code] = upload_to_s3(tr_local, tr_s3_key)
+
+        # 3./4. Chaptering and translation only need the transcript, so they
+        # run concurrently with each other and with the captions upload
+        captions_url, chapters_url, translation_urls = await asyncio.gather(
+            asyncio.to_thread(upload_to_s3, srt_local, captions_s3_key),
+            chapter_stage(job_id, transcript, words),
+            translation_stage(job_id, entries, languages),
+        )
 
         # 5. Callback
         results = {
@@ -107,23 +216,29 @@ def process_job(job_payload: Dict[str, Any]) -> None:
             'chapters': {'reconciled': chapters_url},
             'translations': translation_urls
         }
-        send_callback(job_id, callback_url, results, status='completed')
+        await asyncio.to_thread(send_callback, job_id, callback_url, results, status='completed')
         logger.info(f"Job {job_id} completed successfully.")
 
     except Exception as e:
         logger.exception(f"Error processing job {job_id}")
-        send_callback(job_id, callback_url, {}, status='failed', error_message=str(e))
+        await asyncio.to_thread(
+            send_callback, job_id, callback_url, {}, status='failed', error_message=str(e)
+        )
         raise
 
 
+def process_job(job_payload: Dict[str, Any]) -> None:
+    asyncio.run(process_job_async(job_payload))
+
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(description='Worker for MAP video processing pipeline')
     parser.add_argument('-j', '--job-payload', required=True,
                         help='Path to JSON file containing the job payload')
     args = parser.parse_args()
-    with open(args.job_payload, 'r', encoding='utf-8') as f:
-        payload = json.load(f)
+    with open(args.job_payload, 'rb') as f:
+        payload = orjson.loads(f.read())
     process_job(payload)
 
 